@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# on-disk cache of per-dongle identity and capabilities
+# keyed by VID:PID:serial, validated against the (free) descriptors
+
+import json
+import logging
+import os
+import tempfile
+
+lvl = logging.INFO
+
+if not logging.root.handlers:
+    logging.basicConfig(level=lvl)
+
+log = logging.getLogger(name=__name__)
+
+SCHEMA = 2
+
+# field -> type; the first three every entry must have
+FIELDS = {
+    'manufacturer': str,
+    'product': str,
+    'max_payload': int,
+    'buildinfo': str,
+    'compiler': str,
+    'partnum': int,
+    'radioconfig': dict,
+}
+REQUIRED = ('manufacturer', 'product', 'max_payload')
+RADIOCONFIG_FIELDS = {'bus': int, 'address': int, 'image': str}
+
+
+def default_path():
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'rfspy', 'devices.json')
+
+
+def valid_entry(entry):
+    """whether a cache entry has every field it needs, well typed"""
+    if not isinstance(entry, dict):
+        return False
+    if any(field not in entry for field in REQUIRED):
+        return False
+    for field, kind in FIELDS.items():
+        if field in entry and not isinstance(entry[field], kind):
+            return False
+    radioconfig = entry.get('radioconfig')
+    if radioconfig is not None:
+        for field, kind in RADIOCONFIG_FIELDS.items():
+            if not isinstance(radioconfig.get(field), kind):
+                return False
+        try:
+            bytes.fromhex(radioconfig['image'])
+        except ValueError:
+            return False
+    return True
+
+
+def endpoint_layout(interface):
+    """[[bEndpointAddress, wMaxPacketSize], ...] for an interface"""
+    return [[ep.bEndpointAddress, ep.wMaxPacketSize] for ep in interface]
+
+
+class RfcatCapabilityCache:
+    """json file of dongle entries
+       descriptors come from the host's copy, so checking them costs
+       no USB traffic; they don't change on a reflash though, so
+       RfcatUSB.open also checks the build string"""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as cachefile:
+                data = json.load(cachefile)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            log.warning("unreadable capability cache %s, ignoring",
+                        self.path)
+            return
+        if not isinstance(data, dict) or \
+                not isinstance(data.get('devices'), dict):
+            log.warning("malformed capability cache %s, ignoring",
+                        self.path)
+            return
+        if data.get('schema') != SCHEMA:
+            log.info("capability cache schema changed, starting over")
+            return
+        # bad entries are weeded out by lookup()
+        self.entries = data['devices']
+
+    def save(self):
+        """best-effort; a cache we can't write just means slower opens"""
+        dirname = os.path.dirname(self.path) or '.'
+        tmpfile = None
+        try:
+            os.makedirs(dirname, exist_ok=True)
+            # private temp name, so concurrent writers can't collide
+            with tempfile.NamedTemporaryFile('w', dir=dirname,
+                                             prefix='.devices-',
+                                             delete=False) as tmpfile:
+                json.dump({'schema': SCHEMA, 'devices': self.entries},
+                          tmpfile, indent=1, sort_keys=True)
+            os.replace(tmpfile.name, self.path)
+        except OSError as exc:
+            log.warning("can't write capability cache %s: %s",
+                        self.path, exc)
+            if tmpfile is not None:
+                try:
+                    os.unlink(tmpfile.name)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def key(device):
+        if device.iSerialNumber:
+            serial = device.serial_number
+        else:
+            # no serial string; fall back to where it's plugged in
+            serial = "port-%d-%s" % (device.bus, '.'.join(
+                str(port) for port in (device.port_numbers or ())))
+        return "%04x:%04x:%s" % (device.idVendor, device.idProduct, serial)
+
+    @staticmethod
+    def fingerprint(device, interface):
+        return {
+            'bcdDevice': device.bcdDevice,
+            'endpoints': endpoint_layout(interface),
+        }
+
+    def lookup(self, device, interface):
+        """cached entry for device, or None if unknown or stale"""
+        key = self.key(device)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not valid_entry(entry):
+            log.warning("malformed capability cache entry for %s, "
+                        "dropping it", key)
+            del self.entries[key]
+            return None
+        for field, value in self.fingerprint(device, interface).items():
+            if entry.get(field) != value:
+                log.info("capability cache stale for %s (%s)", key, field)
+                del self.entries[key]
+                return None
+        return entry
+
+    def store(self, device, interface, entry):
+        entry = dict(entry)
+        entry.update(self.fingerprint(device, interface))
+        self.entries[self.key(device)] = entry
+        self.save()
+
+    def forget(self, device):
+        if self.entries.pop(self.key(device), None) is not None:
+            self.save()
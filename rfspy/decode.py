@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+# host-side packet decoding, batched with numpy
+# takes raw demodulated bitstreams (radio capturing without its packet
+# engine) and does what the CC1111 would have: sync search, manchester,
+# PN9 de-whitening, CRC-16
+
+import logging
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+
+lvl = logging.INFO
+
+if not logging.root.handlers:
+    logging.basicConfig(level=lvl)
+
+log = logging.getLogger(name=__name__)
+
+# index: position of the buffer in the input stream
+# offset: bit (chip) offset just past the sync word
+# crc_ok: True, or None when the format has no CRC (failures are skipped)
+Frame = namedtuple('Frame', ['index', 'offset', 'payload', 'crc_ok'])
+
+# MDMCFG2
+MANCHESTER_EN = 0x08
+SYNC_MODE = 0x07
+# PKTCTRL0
+WHITE_DATA = 0x40
+CRC_EN = 0x04
+LENGTH_CONFIG = 0x03
+
+CRC_POLY = 0x8005
+CRC_INIT = 0xffff
+
+
+def pn9(length):
+    """CC1111 data whitening sequence, one byte per byte of packet"""
+    out = np.zeros(length, dtype=np.uint8)
+    key = 0x1ff
+    for idx in range(length):
+        out[idx] = key & 0xff
+        for _ in range(8):
+            key = (key >> 1) | (((key ^ (key >> 5)) & 1) << 8)
+    return out
+
+
+def _crc_table():
+    table = np.zeros(256, dtype=np.uint32)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC_POLY) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xffff
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data):
+    """CRC-16 as computed by the CC1111 packet engine"""
+    crc = CRC_INIT
+    for byte in data:
+        crc = ((crc << 8) ^ int(CRC_TABLE[((crc >> 8) ^ byte) & 0xff])) \
+            & 0xffff
+    return crc
+
+
+def manchester_encode(bits):
+    """one data bit to two chips, 1 -> 10, 0 -> 01"""
+    return np.stack((bits, bits ^ 1), axis=-1).reshape(
+        bits.shape[:-1] + (-1,))
+
+
+class PacketDecoder:
+    """decodes batches of raw bitstreams in the given packet format"""
+    pktlen_max = 255
+
+    def __init__(
+        self,
+        sync=0xd391,
+        sync_bits=16,
+        sync_errors=0,
+        manchester=False,
+        whitening=False,
+        crc=True,
+        variable_length=True,
+        pktlen=pktlen_max,
+    ):
+        self.sync = sync
+        self.sync_bits = sync_bits
+        self.sync_errors = sync_errors
+        self.manchester = manchester
+        self.whitening = whitening
+        self.crc = crc
+        self.variable_length = variable_length
+        self.pktlen = pktlen
+        # longest packet on air, in bytes: length byte, payload, crc
+        self.max_bytes = (int(variable_length) + pktlen +
+                          (2 if crc else 0))
+        self.chips_per_bit = 2 if manchester else 1
+        self.pn9 = pn9(self.max_bytes)
+        syncbits = np.array([(sync >> shift) & 1
+                             for shift in reversed(range(sync_bits))],
+                            dtype=np.uint8)
+        self.sync_chips = (manchester_encode(syncbits)
+                           if manchester else syncbits)
+
+    @classmethod
+    def from_descriptor(cls, desc):
+        """packet format from an RfcatRadioDescriptor's registers"""
+        # descriptor fields are byte-reversed, so index == register number
+        mdmcfg2 = desc.mdmcfg[2]
+        pktctrl0 = desc.pktctrl[0]
+        sync_mode = mdmcfg2 & SYNC_MODE & 0x3
+        if sync_mode == 0:
+            raise ValueError("radio configured without a sync word")
+        length_config = pktctrl0 & LENGTH_CONFIG
+        if length_config not in (0, 1):
+            raise ValueError("unsupported length config %d" % length_config)
+        sync = (desc.sync[1] << 8) | desc.sync[0]
+        if sync_mode == 3:
+            # 30/32: the sync word is sent twice
+            sync_bits, sync_errors, sync = 32, 2, (sync << 16) | sync
+        else:
+            # 1 is 15/16, 2 is 16/16
+            sync_bits, sync_errors = 16, 2 - sync_mode
+        return cls(
+            sync=sync,
+            sync_bits=sync_bits,
+            sync_errors=sync_errors,
+            manchester=bool(mdmcfg2 & MANCHESTER_EN),
+            whitening=bool(pktctrl0 & WHITE_DATA),
+            crc=bool(pktctrl0 & CRC_EN),
+            variable_length=bool(length_config),
+            pktlen=desc.pktlen,
+        )
+
+    def encode(self, payload, lead=0, preamble=4, tail=2):
+        """raw bitstream bytes for payload, as the radio would send it,
+           after lead idle chips (for testing and benchmarking)"""
+        packet = bytearray()
+        if self.variable_length:
+            packet.append(len(payload))
+        elif len(payload) != self.pktlen:
+            raise ValueError("fixed length is %d, got %d"
+                             % (self.pktlen, len(payload)))
+        packet += payload
+        if self.crc:
+            packet += crc16(packet).to_bytes(2, 'big')
+        data = np.frombuffer(bytes(packet), dtype=np.uint8)
+        if self.whitening:
+            data = data ^ self.pn9[:len(data)]
+        bits = np.concatenate((
+            np.tile(np.array([1, 0], dtype=np.uint8), preamble * 4),
+            np.array([(self.sync >> shift) & 1
+                      for shift in reversed(range(self.sync_bits))],
+                     dtype=np.uint8),
+            np.unpackbits(data),
+        ))
+        if self.manchester:
+            bits = manchester_encode(bits)
+        bits = np.concatenate((np.zeros(lead, dtype=np.uint8), bits,
+                               np.zeros(tail * 8, dtype=np.uint8)))
+        return np.packbits(bits).tobytes()
+
+    def _find_sync(self, bits, nbits):
+        """every sync match: (rows, chip offsets past sync), row-major"""
+        width = len(self.sync_chips)
+        positions = bits.shape[1] - width + 1
+        if positions <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        errors = np.zeros((len(bits), positions), dtype=np.uint8)
+        for shift, chip in enumerate(self.sync_chips):
+            errors += bits[:, shift:shift + positions] != chip
+        hits = errors <= self.sync_errors * self.chips_per_bit
+        hits &= np.arange(positions) <= (nbits - width)[:, None]
+        rows, first = np.nonzero(hits)
+        return rows, first + width
+
+    def _read_bytes(self, bits, rows, start, count):
+        """count decoded, de-whitened bytes after each start, plus the
+           first manchester violation (in data bits) for each"""
+        need = count * 8 * self.chips_per_bit
+        idx = np.minimum(start[:, None] + np.arange(need), bits.shape[1] - 1)
+        chips = bits[rows[:, None], idx]
+        if self.manchester:
+            pairs = chips.reshape(len(rows), -1, 2)
+            violation = pairs[:, :, 0] == pairs[:, :, 1]
+            bad_at = np.where(violation.any(axis=1),
+                              violation.argmax(axis=1), need // 2)
+            databits = pairs[:, :, 0]
+        else:
+            bad_at = np.full(len(rows), need)
+            databits = chips
+        data = np.packbits(databits, axis=1)
+        if self.whitening:
+            data ^= self.pn9[:count]
+        return data, bad_at
+
+    def _crc_check(self, data, total):
+        """vectorized CRC over each row's first total-2 bytes"""
+        crc = np.full(len(data), CRC_INIT, dtype=np.uint32)
+        for col in range(int(total.max()) - 2):
+            step = ((crc << 8) ^
+                    CRC_TABLE[((crc >> 8) ^ data[:, col]) & 0xff]) & 0xffff
+            crc = np.where(col < total - 2, step, crc)
+        rows = np.arange(len(data))
+        received = ((data[rows, total - 2].astype(np.uint32) << 8) |
+                    data[rows, total - 1])
+        return crc == received
+
+    def decode_batch(self, buffers, base=0):
+        """decode a list of raw buffers, returning a list of Frames
+           (every frame in each buffer, in order)"""
+        nrows = len(buffers)
+        if not nrows:
+            return []
+        nbytes = np.array([len(buf) for buf in buffers])
+        raw = np.zeros((nrows, int(nbytes.max())), dtype=np.uint8)
+        for row, buf in enumerate(buffers):
+            raw[row, :len(buf)] = np.frombuffer(bytes(buf), dtype=np.uint8)
+        bits = np.unpackbits(raw, axis=1)
+        nbits = nbytes * 8
+
+        # every sync match is a candidate; weed them out in two passes,
+        # the length byte first so the full read is only as wide as needed
+        rows, start = self._find_sync(bits, nbits)
+        header = int(self.variable_length)
+        if header:
+            data, _ = self._read_bytes(bits, rows, start, 1)
+            length = data[:, 0].astype(np.int64)
+        else:
+            length = np.full(len(rows), self.pktlen)
+        total = header + length + (2 if self.crc else 0)
+        chips = total * 8 * self.chips_per_bit
+        keep = (length <= self.pktlen) & (chips <= nbits[rows] - start)
+        rows, start, length, total, chips = (
+            rows[keep], start[keep], length[keep], total[keep], chips[keep])
+        if not len(rows):
+            return []
+        data, bad_at = self._read_bytes(bits, rows, start, int(total.max()))
+        good = total * 8 <= bad_at
+        if self.crc and good.any():
+            good[good] = self._crc_check(data[good], total[good])
+
+        # candidates are row-major and in offset order; take each good
+        # one whose sync starts past the end of the last frame taken
+        width = len(self.sync_chips)
+        frames = []
+        row_end = {}
+        for cand in np.flatnonzero(good):
+            row = int(rows[cand])
+            if start[cand] - width < row_end.get(row, 0):
+                continue
+            row_end[row] = int(start[cand] + chips[cand])
+            payload = data[cand, header:header + length[cand]].tobytes()
+            frames.append(Frame(base + row, int(start[cand]), payload,
+                                True if self.crc else None))
+        log.debug("decoded %d frames from %d buffers (%d sync matches)",
+                  len(frames), nrows, len(rows))
+        return frames
+
+    def decode_reference(self, buf, index=0):
+        """per-buffer pure-python decode, same results as decode_batch;
+           the scalar baseline for benchmark()"""
+        bits = [(byte >> (7 - shift)) & 1
+                for byte in bytes(buf) for shift in range(8)]
+        sync = [int(chip) for chip in self.sync_chips]
+        width = len(sync)
+        allowed = self.sync_errors * self.chips_per_bit
+        frames = []
+        pos = 0
+        while pos + width <= len(bits):
+            errors = sum(1 for have, want in zip(bits[pos:pos + width], sync)
+                         if have != want)
+            if errors <= allowed:
+                frame = self._reference_frame(bits, pos + width, index)
+                if frame is not None:
+                    frames.append(frame[0])
+                    pos = frame[1]
+                    continue
+            pos += 1
+        return frames
+
+    def _reference_frame(self, bits, start, index):
+        """(Frame, end chip) for a sync match at start, or None"""
+        def read_byte(num):
+            value = 0
+            at = start + num * 8 * self.chips_per_bit
+            for _ in range(8):
+                if at + self.chips_per_bit > len(bits):
+                    return None
+                if self.manchester:
+                    if bits[at] == bits[at + 1]:
+                        return None
+                value = (value << 1) | bits[at]
+                at += self.chips_per_bit
+            return value ^ (int(self.pn9[num]) if self.whitening else 0)
+
+        header = int(self.variable_length)
+        length = read_byte(0) if header else self.pktlen
+        if length is None or length > self.pktlen:
+            return None
+        total = header + length + (2 if self.crc else 0)
+        packet = bytearray()
+        for num in range(total):
+            value = read_byte(num)
+            if value is None:
+                return None
+            packet.append(value)
+        if self.crc and crc16(packet[:-2]) != (packet[-2] << 8 | packet[-1]):
+            return None
+        end = start + total * 8 * self.chips_per_bit
+        return (Frame(index, start, bytes(packet[header:header + length]),
+                      True if self.crc else None), end)
+
+    def stream(self, buffers, batch=256):
+        """generator stage: iterable of raw buffers in, Frames out"""
+        pending = []
+        base = 0
+        for buf in buffers:
+            pending.append(buf)
+            if len(pending) >= batch:
+                yield from self.decode_batch(pending, base)
+                base += len(pending)
+                pending = []
+        if pending:
+            yield from self.decode_batch(pending, base)
+
+
+def benchmark(decoder=None, frames=10000, payload=32, batch=256,
+              reference_frames=500):
+    """decode synthetic frames; returns (vectorized, scalar reference)
+       frames/sec, the reference timed on the first reference_frames"""
+    if decoder is None:
+        decoder = PacketDecoder(manchester=True, whitening=True)
+    if not decoder.variable_length:
+        payload = decoder.pktlen
+    buffers = []
+    for _ in range(frames):
+        body = bytes(random.randint(0, 255) for _ in range(payload))
+        # so sync lands on arbitrary bit offsets
+        buffers.append(decoder.encode(body, lead=random.randint(0, 63)))
+    begin = time.perf_counter()
+    decoded = sum(1 for frame in decoder.stream(buffers, batch=batch))
+    elapsed = time.perf_counter() - begin
+    if decoded != frames:
+        log.warning("decoded %d of %d frames", decoded, frames)
+    subset = buffers[:reference_frames]
+    begin = time.perf_counter()
+    for index, buf in enumerate(subset):
+        decoder.decode_reference(buf, index)
+    ref_elapsed = time.perf_counter() - begin
+    return frames / elapsed, len(subset) / ref_elapsed
@@ -87,6 +87,7 @@ class USB:
 
 class APP:
     GENERIC = 0x01
+    NIC = 0x42
     DEBUG = 0xfe
     SYSTEM = 0xff
 
@@ -108,6 +109,12 @@ class SYS:
         CLEAR_CODES = 0x90
 
 
+class NIC:
+    class CMD:
+        RECV = 0x01
+        XMIT = 0x02
+
+
 class EP0:
     class CMD:
         GET_DEBUG_CODES = 0x00
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+# IN endpoint demultiplexer
+# firmware interleaves RPC replies, debug output and NIC data
+# on the same endpoint; sort them out by app/cmd
+
+import array
+import errno
+import logging
+import queue
+import struct
+import threading
+import time
+
+import usb.core
+
+from .defs import APP, DEBUG, NIC
+
+lvl = logging.INFO
+
+if not logging.root.handlers:
+    logging.basicConfig(level=lvl)
+
+log = logging.getLogger(name=__name__)
+# firmware debug output gets its own logger so it can be silenced
+fwlog = logging.getLogger(name=__name__ + '.firmware')
+
+
+def decode_debug(cmd, buf):
+    """turn an APP.DEBUG payload into something printable"""
+    try:
+        if cmd == DEBUG.CMD.STRING:
+            return buf.rstrip(b'\x00').decode('ascii', errors='replace')
+        if cmd == DEBUG.CMD.HEX:
+            return "0x%02x" % buf[0]
+        if cmd == DEBUG.CMD.HEX16:
+            return "0x%04x" % struct.unpack("<H", buf[:2])[0]
+        if cmd == DEBUG.CMD.HEX32:
+            return "0x%08x" % struct.unpack("<L", buf[:4])[0]
+        if cmd == DEBUG.CMD.INT:
+            return "%d" % struct.unpack("<L", buf[:4])[0]
+    except (IndexError, struct.error):
+        log.warning("short debug payload: cmd %x len %d", cmd, len(buf))
+    return buf.hex()
+
+
+def _is_timeout(exc):
+    return (isinstance(exc, usb.core.USBTimeoutError) or
+            getattr(exc, 'errno', None) == errno.ETIMEDOUT)
+
+
+def _put_lossy(q, item):
+    """put into a bounded queue, dropping the oldest entry when full"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class RfcatDemux:
+    """background reader that routes each IN packet by app/cmd
+
+       APP.DEBUG   -> decoded into `debug` (and logged)
+       NIC recv    -> `nic`, or registered receivers
+       all else    -> per-(app, cmd) reply queues for rpc waiters,
+                      dropped if that pair was never asked for
+    """
+    poll_timeout = 100
+    debug_depth = 256
+    nic_depth = 1024
+    reply_depth = 8
+
+    def __init__(self, readEp):
+        self.readEp = readEp
+        self.replies = {}
+        self.receivers = {}
+        self.debug = queue.Queue(maxsize=self.debug_depth)
+        self.nic = queue.Queue(maxsize=self.nic_depth)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # what killed the reader, handed on to anyone waiting on it
+        self.error = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="rfspy-demux",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reply_queue(self, app, cmd):
+        with self._lock:
+            return self.replies.setdefault(
+                (app, cmd), queue.Queue(maxsize=self.reply_depth))
+
+    def wait_reply(self, app, cmd, timeout=None):
+        """block until a reply for app/cmd shows up; returns its buffer
+           raises the reader's USBError if it died, or USBTimeoutError"""
+        replies = self.reply_queue(app, cmd)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.poll_timeout / 1000
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            try:
+                return replies.get(timeout=wait)
+            except queue.Empty:
+                pass
+            if self.error is not None:
+                raise self.error
+            if deadline is not None and time.monotonic() >= deadline:
+                raise usb.core.USBTimeoutError(
+                    "no reply for app %x cmd %x" % (app, cmd),
+                    None, errno.ETIMEDOUT)
+
+    def add_receiver(self, app, cmd, callback):
+        """call callback(app, cmd, buf) for every matching packet
+           instead of queueing it"""
+        with self._lock:
+            self.receivers.setdefault((app, cmd), []).append(callback)
+
+    def remove_receiver(self, app, cmd, callback):
+        with self._lock:
+            self.receivers.get((app, cmd), []).remove(callback)
+
+    def read_packet(self):
+        """read one framed message, reassembling multi-packet payloads"""
+        rbuf = array.array('B', (0,) * self.readEp.wMaxPacketSize)
+        rsz = self.readEp.read(rbuf, self.poll_timeout)
+        if rsz < 5:
+            log.warning("runt packet (%d bytes) discarded", rsz)
+            return None
+        app = rbuf[1]
+        cmd = rbuf[2]
+        buflen = struct.unpack("<H", bytes(rbuf[3:5]))[0]
+        buf = bytes(rbuf[5:rsz])
+        while len(buf) < buflen:
+            # a continuation should follow promptly; let a timeout
+            # propagate rather than hand back half a message
+            rsz = self.readEp.read(rbuf, self.poll_timeout)
+            buf += bytes(rbuf[:rsz])
+        if len(buf) > buflen:
+            log.warning("return size mismatch; read %d embedlen %d",
+                        len(buf), buflen)
+            buf = buf[:buflen]
+        return (app, cmd, buf)
+
+    def dispatch(self, app, cmd, buf):
+        with self._lock:
+            callbacks = list(self.receivers.get((app, cmd), ()))
+        if callbacks:
+            for callback in callbacks:
+                try:
+                    callback(app, cmd, buf)
+                except Exception:
+                    log.exception("receiver for app %x cmd %x failed",
+                                  app, cmd)
+        elif app == APP.DEBUG:
+            msg = decode_debug(cmd, buf)
+            fwlog.debug("%s", msg)
+            _put_lossy(self.debug, (cmd, msg))
+        elif app == APP.NIC and cmd == NIC.CMD.RECV:
+            _put_lossy(self.nic, buf)
+        else:
+            with self._lock:
+                replies = self.replies.get((app, cmd))
+            if replies is None:
+                # nobody has ever asked for this one
+                log.warning("unsolicited app %x cmd %x (%d bytes) dropped",
+                            app, cmd, len(buf))
+            else:
+                _put_lossy(replies, buf)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                packet = self.read_packet()
+            except usb.core.USBError as exc:
+                if _is_timeout(exc):
+                    continue
+                log.exception("demux read failed, stopping")
+                self.error = exc
+                break
+            if packet is not None:
+                self.dispatch(*packet)
@@ -11,6 +11,7 @@ from binascii import hexlify
 import array
 import traceback
 from .defs import APP, SYS
+from .demux import RfcatDemux
 
 lvl = logging.INFO
 
@@ -33,13 +34,19 @@ class RfcatUSB:
     bus = None
     address = None
     state = 'uninitialized'
+    demux = None
+    rpc_timeout = 1.0
+    cache = None
 
     def __init__(
         self,
         device,
-        reset_on_exit=False
+        reset_on_exit=False,
+        cache=None,
     ):
         self.device = device
+        self.cache = cache
+        self.capabilities = {}
         self.get_info()
         self.reset_on_exit = reset_on_exit
 
@@ -51,8 +58,6 @@ class RfcatUSB:
         if resets is None:
             resets = self.reset_tries
         try:
-            self.manufacturer = self.device.manufacturer
-            self.product = self.device.product
             self.bus = self.device.bus
             self.address = self.device.address
             self.configuration = self.device[0]
@@ -70,14 +75,51 @@ class RfcatUSB:
             self.max_payload = (min((self.readEp.wMaxPacketSize,
                                      self.writeEp.wMaxPacketSize))
                                 - 5)
-            self.state = 'enumerated'
+            if self.cache is not None:
+                # the serial string read is USB traffic; pyusb keeps it
+                self.cache.key(self.device)
         except Exception:
-            if resets:
-                log.error("USB problem, attempting reset")
-                self.device.reset()
-                self.get_info(resets=resets - 1)
-            else:
-                raise
+            return self._retry_info(resets)
+        # outside the try: a cache problem is not a USB problem
+        entry = self.lookup_capabilities()
+        if entry is None:
+            try:
+                # string descriptors are a control transfer apiece
+                self.manufacturer = self.device.manufacturer
+                self.product = self.device.product
+            except Exception:
+                return self._retry_info(resets)
+            self.capabilities = {'manufacturer': self.manufacturer,
+                                 'product': self.product,
+                                 'max_payload': self.max_payload}
+            self.save_capabilities()
+        else:
+            self.capabilities = entry
+            self.manufacturer = entry['manufacturer']
+            self.product = entry['product']
+        self.state = 'enumerated'
+
+    def _retry_info(self, resets):
+        """called while handling a USB problem in get_info"""
+        if not resets:
+            raise
+        log.error("USB problem, attempting reset")
+        self.device.reset()
+        self.get_info(resets=resets - 1)
+
+    def lookup_capabilities(self):
+        """validated cache entry for this dongle, never raises"""
+        if self.cache is None:
+            return None
+        try:
+            entry = self.cache.lookup(self.device, self.interface)
+        except Exception:
+            log.exception("capability cache lookup failed, ignoring")
+            return None
+        if entry is not None:
+            log.debug("capability cache hit for %s",
+                      self.cache.key(self.device))
+        return entry
 
     def open(self):
         try:
@@ -89,12 +131,58 @@ class RfcatUSB:
             # we only have one configuration, but are required to set it
             self.device.set_configuration()
         self.state = 'initialized'
+        if self.cache is not None:
+            self.check_capabilities()
+
+    def check_capabilities(self):
+        """the one round-trip a cached open spends: descriptors survive
+           a reflash, the build string doesn't, and a new build means
+           nothing cached about the old firmware holds"""
+        live = self._query_buildinfo()
+        cached = self.capabilities.get('buildinfo')
+        if cached == live:
+            return
+        if cached is not None:
+            log.info("firmware changed (%s -> %s), dropping cached "
+                     "capabilities", cached, live)
+        self.capabilities = {name: self.capabilities[name]
+                             for name in ('manufacturer', 'product',
+                                          'max_payload')}
+        self.capabilities['buildinfo'] = live
+        self.save_capabilities()
+
+    def save_capabilities(self):
+        """write what we know about this dongle to the cache"""
+        if self.cache is not None:
+            self.cache.store(self.device, self.interface, self.capabilities)
+
+    def cached_query(self, name, query, refresh=False):
+        """answer from the capability cache, asking the dongle
+           (and remembering the answer) on a miss"""
+        if refresh or name not in self.capabilities:
+            self.capabilities[name] = query()
+            self.save_capabilities()
+        return self.capabilities[name]
 
     def close(self, force_reset=False):
+        self.stop_demux()
         if self.reset_on_exit or force_reset:
             self.reset()
         self.state = 'closed'
 
+    def start_demux(self):
+        """route IN traffic through a background demultiplexer;
+           rpc replies, debug output and NIC data each get a queue"""
+        if self.demux is None:
+            self.demux = RfcatDemux(self.readEp)
+        self.demux.start()
+        return self.demux
+
+    def stop_demux(self):
+        if self.demux is not None:
+            self.demux.stop()
+            self.demux = None
+
     def write_rpc(self, app, cmd, buf=None):
         if buf is None:
             buf = b''
@@ -107,6 +195,8 @@ class RfcatUSB:
         return payload
 
     def rpc_sym(self, app, cmd, buf):
+        if self.demux is not None:
+            return self.rpc(app, cmd, buf)
         payloadsz, writtensz = self.write_rpc(app, cmd, buf)
         log.debug("attempted %d, wrote %d", payloadsz, writtensz)
         # extra byte for free yo
@@ -126,6 +216,18 @@ class RfcatUSB:
         return buf
 
     def rpc(self, app, cmd, buf=None):
+        if self.demux is not None:
+            if self.demux.error is not None:
+                # the reader is dead; say why rather than time out
+                raise self.demux.error
+            replies = self.demux.reply_queue(app, cmd)
+            # anything already queued is a leftover from a timed-out call
+            while not replies.empty():
+                log.warning("discarding stale reply for app %x cmd %x",
+                            app, cmd)
+                replies.get_nowait()
+            self.write_rpc(app, cmd, buf)
+            return self.demux.wait_reply(app, cmd, timeout=self.rpc_timeout)
         payloadsz, writtensz = self.write_rpc(app, cmd, buf)
         rapp, rcmd, rbuflen, rbuf = self.read_drain()
         if rapp != app:
@@ -254,11 +356,26 @@ class RfcatUSB:
             bbuf += self.peek(addr, amt)
         return bbuf
 
-    def get_buildinfo(self):
+    def get_buildinfo(self, refresh=False):
         """retrieves the build information (null-terminated)"""
+        return self.cached_query('buildinfo', self._query_buildinfo, refresh)
+
+    def _query_buildinfo(self):
         bbuf = self.rpc(APP.SYSTEM, SYS.CMD.BUILDTYPE)
         return bbuf.rstrip(b'\x00').decode('ascii')
 
+    def get_compiler(self, refresh=False):
+        """retrieves the firmware compiler information (null-terminated)"""
+        def query():
+            bbuf = self.rpc(APP.SYSTEM, SYS.CMD.COMPILER)
+            return bbuf.rstrip(b'\x00').decode('ascii')
+        return self.cached_query('compiler', query, refresh)
+
+    def get_partnum(self, refresh=False):
+        """retrieves the radio chip part number"""
+        def query():
+            return self.rpc(APP.SYSTEM, SYS.CMD.PARTNUM)[0]
+        return self.cached_query('partnum', query, refresh)
 
     def __repr__(self):
         return "<%s %s : %s @ USB %d:%d %s>" % (
@@ -290,9 +407,10 @@ class RfcatManager:
             return list(usb.core.find(find_all=True,
                                       custom_match=custom_match))
 
-    def __init__(self, usbdongles=None, factory=RfcatUSB):
+    def __init__(self, usbdongles=None, factory=RfcatUSB, cache=None):
         self.usbdongles = usbdongles or []
         self.factory = factory
+        self.cache = cache
         self.enumerate()
 
     def enumerate(self):
@@ -318,4 +436,8 @@ class RfcatManager:
 
     def all_dongles(self):
         for device in self.all_devices():
-            yield self.factory(device)
+            if self.cache is None:
+                # factories predating the cache don't take one
+                yield self.factory(device)
+            else:
+                yield self.factory(device, cache=self.cache)
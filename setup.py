@@ -61,6 +61,7 @@ def do_setup():
         author='Dave Carlson',
         author_email='thecubic@thecubic.net',
         install_requires=['pyusb'],
+        extras_require={'decode': ['numpy']},
         packages=[package],
         scripts=get_scripts(),
         license="Apache 2.0",